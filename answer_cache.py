@@ -0,0 +1,118 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TABLE_REFERENCE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(`[^`]+`|[\w.-]+)', re.IGNORECASE)
+CTE_NAME_PATTERN = re.compile(r'(?:\bWITH|,)\s+(?:RECURSIVE\s+)?`?(\w+)`?\s+AS\s*\(', re.IGNORECASE)
+# EXTRACT(part FROM column) is not a table reference
+EXTRACT_FROM_PATTERN = re.compile(r'\bEXTRACT\s*\(\s*\w+(?:\s*\(\s*\w+\s*\))?\s+FROM\b', re.IGNORECASE)
+# Comma joins: "FROM a [AS x], b" or a fully qualified table after any comma
+COMMA_JOIN_PATTERN = re.compile(
+    r'\bFROM\s+(?:`[^`]+`|[\w.-]+)(?:\s+(?:AS\s+)?\w+)?\s*,|,\s*`?[\w-]+\.[\w-]+\.[\w-]+',
+    re.IGNORECASE
+)
+# String literals, so their contents are not mistaken for SQL
+STRING_LITERAL_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"")
+# Functions whose result changes between runs of the same query
+VOLATILE_FUNCTION_PATTERN = re.compile(
+    r'\b(?:CURRENT_\w+|NOW|RAND|GENERATE_UUID|SESSION_USER)\b', re.IGNORECASE
+)
+
+
+def referenced_tables(sql, default_project=None):
+    """
+    Return the tables read by a generated SQL query as (project, dataset, table)
+    tuples, or None if a reference cannot be resolved.
+    """
+    if "'''" in sql or '"""' in sql or '\\' in sql:
+        # Escaped and triple-quoted strings are not handled by the literal masking below
+        return None
+    masked_sql = STRING_LITERAL_PATTERN.sub("''", sql)
+    masked_sql = EXTRACT_FROM_PATTERN.sub('EXTRACT(', masked_sql)
+    if COMMA_JOIN_PATTERN.search(masked_sql):
+        # Tables after a comma are easy to miss, don't try to resolve them
+        return None
+
+    cte_names = {name.lower() for name in CTE_NAME_PATTERN.findall(masked_sql)}
+    tables = set()
+    for reference in TABLE_REFERENCE_PATTERN.findall(masked_sql):
+        name = reference.strip('`')
+        if name.lower() in cte_names or name.upper() == 'UNNEST':
+            continue
+        parts = name.split('.')
+        if len(parts) == 3:
+            tables.add(tuple(parts))
+        elif len(parts) == 2:
+            tables.add((default_project, parts[0], parts[1]))
+        else:
+            # Unqualified names depend on the default dataset, don't guess
+            return None
+    return tables
+
+
+class ReferenceAnswerCache:
+    """
+    Cache of complete chat answers whose SQL only reads small, rarely changing
+    reference tables (currency rates, account lists, ...).
+
+    Entries are keyed like coalesced requests (agent, normalized message and
+    history), expire after ttl seconds and are evicted oldest first beyond
+    max_entries. The cached text and tables are served together, so a hit
+    returns exactly what the agent answered.
+    """
+
+    def __init__(self, table_ids, ttl=3600, max_entries=1000):
+        self.table_ids = {t.strip() for t in table_ids if t.strip()}
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, sql, project_id, dataset_id):
+        """Check whether sql is a query that only reads configured reference tables"""
+        if not sql or not re.match(r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+            return False
+        if VOLATILE_FUNCTION_PATTERN.search(STRING_LITERAL_PATTERN.sub("''", sql)):
+            # e.g. "this month" answers change with the date
+            return False
+        tables = referenced_tables(sql, default_project=project_id)
+        if not tables:
+            return False
+        return all(
+            project == project_id and dataset == dataset_id and table in self.table_ids
+            for project, dataset, table in tables
+        )
+
+    def get(self, key):
+        """Return the cached answer for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, response_data = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            return response_data
+
+    def put(self, key, response_data, project_id, dataset_id):
+        """Cache response_data if its single SQL query only reads reference tables"""
+        sql_queries = [sql for sql in response_data['sql_queries'] if sql.strip()]
+        if len(sql_queries) != 1 or not self.is_cacheable(sql_queries[0], project_id, dataset_id):
+            return False
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response_data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logger.info(f"Cached answer reading only reference tables ({len(self._entries)} cached)")
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_file
 from flask_cors import CORS
 from google.cloud import geminidataanalytics
 from google.auth import default
@@ -7,7 +7,11 @@ import proto
 import os
 import logging
 import time
+from contextlib import closing
 from config import Config
+from profiling import RequestProfiler
+from coalescing import SingleFlight, CoalescedCallCancelled, coalescing_key
+from answer_cache import ReferenceAnswerCache
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -28,6 +32,16 @@ class BigQueryChatbot:
         self.data_chat_client = None
         self.data_agent_client = None
         self.data_agent_name = None
+        self.chat_coalescer = None
+        if app.config.get('CHAT_COALESCING_ENABLED', True):
+            self.chat_coalescer = SingleFlight(wait_timeout=app.config.get('CHAT_COALESCING_WAIT_TIMEOUT', 300))
+        self.answer_cache = None
+        if app.config.get('ANSWER_CACHE_TABLES'):
+            self.answer_cache = ReferenceAnswerCache(
+                app.config['ANSWER_CACHE_TABLES'],
+                ttl=app.config.get('ANSWER_CACHE_TTL', 3600),
+                max_entries=app.config.get('ANSWER_CACHE_MAX_ANSWERS', 1000)
+            )
         self.initialize_client()
 
     def discover_tables(self):
@@ -206,6 +220,15 @@ class BigQueryChatbot:
                 logger.info("Data agent not initialized. Creating now...")
                 self.create_data_agent()
 
+            key = coalescing_key(self.data_agent_name, message, conversation_history)
+
+            # Questions answered from reference tables only are served from the answer cache
+            if self.answer_cache:
+                cached_response = self.answer_cache.get(key)
+                if cached_response:
+                    logger.info("Answered chat request from the reference table answer cache")
+                    return cached_response
+
             # Prepare conversation history and the new message
             all_messages = []
             if conversation_history:
@@ -238,65 +261,86 @@ class BigQueryChatbot:
             )
 
             logger.info(f"Sending chat request with message: {message[:100]}...")
-            stream = self.data_chat_client.chat(request=request, timeout=300)
-
-            # Process the streaming response - REMOVED charts array
-            response_data = {'text': '', 'tables': [], 'sql_queries': []}
-
-            for reply in stream:
-                logger.info(f"Processing reply with attributes: {dir(reply)}")
-
-                if hasattr(reply, 'system_message'):
-                    system_msg = reply.system_message
-                    logger.info(f"System message attributes: {dir(system_msg)}")
-
-                    # Handle text responses
-                    if hasattr(system_msg, 'text') and system_msg.text:
-                        if hasattr(system_msg.text, 'parts'):
-                            response_data['text'] += ''.join(system_msg.text.parts)
-                        elif hasattr(system_msg.text, 'text'):
-                            response_data['text'] += system_msg.text.text
-
-                    # Handle schema responses
-                    if hasattr(system_msg, 'schema') and system_msg.schema:
-                        logger.info("Found schema response")
-                        # Process schema information if needed
-                        pass
-
-                    # Handle data responses (tables)
-                    if hasattr(system_msg, 'data') and system_msg.data:
-                        logger.info(f"Found data response with attributes: {dir(system_msg.data)}")
-                        # Extract table data
-                        if hasattr(system_msg.data, 'result') and system_msg.data.result:
-                            logger.info(f"Data result attributes: {dir(system_msg.data.result)}")
-                            table_data = self._extract_table_data(system_msg.data.result)
-                            if table_data:
-                                # Format the table data for better rendering
-                                formatted_table = self._format_table_for_rendering(table_data)
-                                response_data['tables'].append(formatted_table)
-
-                        # Handle SQL queries
-                        if hasattr(system_msg.data, 'generated_sql'):
-                            response_data['sql_queries'].append(str(system_msg.data.generated_sql))
-
-                    # REMOVED all chart handling code
-                    # Skip chart responses entirely
-                    if hasattr(system_msg, 'chart') and system_msg.chart:
-                        logger.info("Skipping chart response - chart rendering disabled")
-                        continue
-
-                    # Skip chart detection in system message string
-                    if "chart" in str(system_msg):
-                        logger.info("Found chart reference in system message - skipping")
-                        continue
-
-            logger.info("Chat response processed successfully")
+
+            def open_stream():
+                return self.data_chat_client.chat(request=request, timeout=300)
+
+            if not self.chat_coalescer:
+                response_data = self._process_chat_stream(open_stream())
+            else:
+                while True:
+                    try:
+                        # Close explicitly so a failing leader releases its followers right away
+                        with closing(self.chat_coalescer.stream(key, open_stream)) as stream:
+                            response_data = self._process_chat_stream(stream)
+                        break
+                    except CoalescedCallCancelled:
+                        # The leader went away mid-stream; start over, possibly as the new leader
+                        logger.info("Coalesced chat request was cancelled by its leader, retrying")
+
+            if self.answer_cache:
+                self.answer_cache.put(key, response_data, self.project_id, self.dataset_id)
             return response_data
 
         except Exception as e:
             logger.error(f"Chat error: {e}")
             raise
 
+    def _process_chat_stream(self, stream):
+        """Build the response payload from a chat reply stream"""
+        # Process the streaming response - REMOVED charts array
+        response_data = {'text': '', 'tables': [], 'sql_queries': []}
+
+        for reply in stream:
+            logger.info(f"Processing reply with attributes: {dir(reply)}")
+
+            if hasattr(reply, 'system_message'):
+                system_msg = reply.system_message
+                logger.info(f"System message attributes: {dir(system_msg)}")
+
+                # Handle text responses
+                if hasattr(system_msg, 'text') and system_msg.text:
+                    if hasattr(system_msg.text, 'parts'):
+                        response_data['text'] += ''.join(system_msg.text.parts)
+                    elif hasattr(system_msg.text, 'text'):
+                        response_data['text'] += system_msg.text.text
+
+                # Handle schema responses
+                if hasattr(system_msg, 'schema') and system_msg.schema:
+                    logger.info("Found schema response")
+                    # Process schema information if needed
+                    pass
+
+                # Handle data responses (tables)
+                if hasattr(system_msg, 'data') and system_msg.data:
+                    logger.info(f"Found data response with attributes: {dir(system_msg.data)}")
+                    # Extract table data
+                    if hasattr(system_msg.data, 'result') and system_msg.data.result:
+                        logger.info(f"Data result attributes: {dir(system_msg.data.result)}")
+                        table_data = self._extract_table_data(system_msg.data.result)
+                        if table_data:
+                            # Format the table data for better rendering
+                            formatted_table = self._format_table_for_rendering(table_data)
+                            response_data['tables'].append(formatted_table)
+
+                    # Handle SQL queries
+                    if hasattr(system_msg.data, 'generated_sql'):
+                        response_data['sql_queries'].append(str(system_msg.data.generated_sql))
+
+                # REMOVED all chart handling code
+                # Skip chart responses entirely
+                if hasattr(system_msg, 'chart') and system_msg.chart:
+                    logger.info("Skipping chart response - chart rendering disabled")
+                    continue
+
+                # Skip chart detection in system message string
+                if "chart" in str(system_msg):
+                    logger.info("Found chart reference in system message - skipping")
+                    continue
+
+        logger.info("Chat response processed successfully")
+        return response_data
+
     def clean_response_text(self, response_text):
         """
         Clean and format the response text from Gemini to improve readability
@@ -463,6 +507,8 @@ chatbot = BigQueryChatbot(
     dataset_id=app.config['BIGQUERY_DATASET_ID']
 )
 
+request_profiler = RequestProfiler(app.config)
+
 
 @app.route('/')
 def index():
@@ -520,6 +566,7 @@ def initialize_agent():
 
 
 @app.route('/api/chat', methods=['POST'])
+@request_profiler.profile
 def chat_endpoint():
     """Handle chat API requests with optional config"""
     try:
@@ -549,5 +596,34 @@ def chat_endpoint():
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """List stored request profiles (admin only)"""
+    if not request_profiler.is_authorized():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'profiles': request_profiler.list_profiles()})
+
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a stored profile as pstats data, or its summary with ?format=summary (admin only)"""
+    if not request_profiler.is_authorized():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+
+    if request.args.get('format') == 'summary':
+        summary = request_profiler.get_summary(profile_id)
+        if summary is None:
+            return jsonify({'success': False, 'error': 'Profile not found'}), 404
+        return jsonify({'success': True, 'profile': summary})
+
+    path = request_profiler.get_stats_path(profile_id)
+    if not path:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f"{profile_id}.prof")
+
+
 if __name__ == '__main__':
     app.run(debug=app.config.get('DEBUG', True), host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescedCallCancelled(Exception):
+    """Raised to followers when the leader stopped consuming the shared stream"""
+
+
+class CoalescedCallFailed(Exception):
+    """Raised to followers when the shared upstream stream failed, chained to the leader's error"""
+
+
+def coalescing_key(agent_name, message, history):
+    """Build the single-flight key from agent, normalized message and a hash of the history"""
+    normalized_message = re.sub(r'\s+', ' ', message or '').strip()
+    history_hash = hashlib.sha256(
+        json.dumps(history or [], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return hashlib.sha256(
+        json.dumps([agent_name, normalized_message, history_hash]).encode()
+    ).hexdigest()
+
+
+class _InFlightCall:
+    """Chunks of one upstream stream, shared between its leader and followers"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.condition = threading.Condition()
+
+    def publish(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+
+class _LeaderStream:
+    """
+    Iterator handed to the leader. It opens the upstream stream lazily and
+    releases the in-flight call once it is exhausted, fails or is closed,
+    even if it was closed before the first chunk was read.
+    """
+
+    def __init__(self, release, call, open_stream):
+        self._release = release
+        self._call = call
+        self._open_stream = open_stream
+        self._upstream = None
+        self._finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        try:
+            if self._upstream is None:
+                self._upstream = iter(self._open_stream())
+            chunk = next(self._upstream)
+        except StopIteration:
+            self._finish(None)
+            raise
+        except BaseException as e:
+            self._finish(e)
+            raise
+        self._call.publish(chunk)
+        return chunk
+
+    def close(self):
+        if not self._finished:
+            # Don't leave the upstream call streaming for nobody (gRPC streaming calls support cancel())
+            if self._upstream is not None and hasattr(self._upstream, 'cancel'):
+                try:
+                    self._upstream.cancel()
+                except Exception as e:
+                    logger.warning(f"Failed to cancel upstream stream: {e}")
+            self._finish(CoalescedCallCancelled("Leader stopped reading the shared stream"))
+
+    __del__ = close
+
+    def _finish(self, error):
+        self._finished = True
+        self._release(self._call, error)
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight streaming calls.
+
+    The first caller for a key (the leader) opens the upstream stream; callers
+    arriving while it is still running (followers) replay the chunks received
+    so far and then receive new chunks as the leader reads them. Upstream
+    errors reach every follower as CoalescedCallFailed. If the leader stops
+    before the stream is exhausted, followers get CoalescedCallCancelled so
+    they can retry.
+    """
+
+    def __init__(self, wait_timeout=300):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key, open_stream):
+        """Return an iterator over the stream for key, opening it with open_stream() if not in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _InFlightCall()
+                self._calls[key] = call
+                is_leader = True
+            else:
+                call.followers += 1
+                is_leader = False
+
+        if is_leader:
+            return _LeaderStream(functools.partial(self._release, key), call, open_stream)
+        logger.info(f"Coalescing request onto in-flight call {key[:12]} ({call.followers} followers)")
+        return self._follow(call)
+
+    def _release(self, key, call, error):
+        # Stop new callers from joining before waking up the followers
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.finish(error)
+
+    def _follow(self, call):
+        index = 0
+        while True:
+            with call.condition:
+                while index >= len(call.chunks) and not call.done:
+                    if not call.condition.wait(timeout=self.wait_timeout):
+                        raise TimeoutError("Timed out waiting for the coalesced stream")
+                chunks = call.chunks[index:]
+                done = call.done
+                error = call.error
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index >= len(call.chunks):
+                # Each follower raises its own exception so tracebacks don't mix across threads
+                if isinstance(error, CoalescedCallCancelled):
+                    raise CoalescedCallCancelled(str(error))
+                if error is not None:
+                    raise CoalescedCallFailed(f"Coalesced chat request failed: {error}") from error
+                return
@@ -31,4 +31,20 @@ class Config:
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 
     # CORS Configuration
-    CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
\ No newline at end of file
+    CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
+
+    # Profiling Configuration (disabled unless a token or sample rate is set)
+    PROFILING_ADMIN_TOKEN = os.getenv('PROFILING_ADMIN_TOKEN', '')
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))  # percent of /api/chat requests
+    PROFILING_DIR = os.getenv('PROFILING_DIR', 'profiles')
+    PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '50'))
+    PROFILING_TOP_N = int(os.getenv('PROFILING_TOP_N', '25'))  # functions and allocation sites per summary
+
+    # Request Coalescing (identical in-flight /api/chat questions share one upstream stream)
+    CHAT_COALESCING_ENABLED = os.getenv('CHAT_COALESCING_ENABLED', 'True').lower() == 'true'
+    CHAT_COALESCING_WAIT_TIMEOUT = float(os.getenv('CHAT_COALESCING_WAIT_TIMEOUT', '300'))
+
+    # Reference Table Answer Cache (answers reading only these small, rarely changing tables are cached)
+    ANSWER_CACHE_TABLES = [t for t in os.getenv('ANSWER_CACHE_TABLES', '').split(',') if t.strip()]
+    ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))  # seconds
+    ANSWER_CACHE_MAX_ANSWERS = int(os.getenv('ANSWER_CACHE_MAX_ANSWERS', '1000'))
@@ -0,0 +1,221 @@
+import cProfile
+import functools
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request CPU and allocation profiling.
+
+    A request is profiled when it carries an admin-authenticated
+    'X-Profile: 1' header (or '?profile=1' query flag), or when it is picked
+    by the sampling rate. Profiles are written to PROFILING_DIR as pstats
+    files ('.prof', readable by pstats, snakeviz, flameprof, ...) with a
+    JSON summary next to them.
+    """
+
+    def __init__(self, config):
+        self.admin_token = config.get('PROFILING_ADMIN_TOKEN') or None
+        self.sample_rate = float(config.get('PROFILING_SAMPLE_RATE', 0) or 0)
+        self.output_dir = config.get('PROFILING_DIR', 'profiles')
+        self.max_profiles = int(config.get('PROFILING_MAX_PROFILES', 50))
+        self.top_n = int(config.get('PROFILING_TOP_N', 25))
+        # cProfile and tracemalloc are process-wide, so only one request is profiled at a time
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token) or self.sample_rate > 0
+
+    def is_authorized(self):
+        """Check the admin token sent with the current request"""
+        if not self.admin_token:
+            return False
+        token = request.headers.get('X-Profile-Token', '')
+        return hmac.compare_digest(token.encode(), self.admin_token.encode())
+
+    def _should_profile(self):
+        """Decide whether the current request gets profiled and why"""
+        flag = request.headers.get('X-Profile') or request.args.get('profile')
+        if flag and flag.lower() in ('1', 'true', 'yes'):
+            if self.is_authorized():
+                return 'requested'
+            logger.warning("Ignoring profile request with missing or invalid admin token")
+        if self.sample_rate > 0 and random.random() * 100 < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def profile(self, view):
+        """Decorator that profiles a Flask view when the request opts in"""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return view(*args, **kwargs)
+
+            reason = self._should_profile()
+            if not reason:
+                return view(*args, **kwargs)
+
+            if not self._lock.acquire(blocking=False):
+                logger.info("Another request is being profiled, skipping profile for this one")
+                return view(*args, **kwargs)
+
+            started_tracemalloc = False
+            try:
+                profile_id = uuid.uuid4().hex
+                profiler = cProfile.Profile()
+                started_tracemalloc = not tracemalloc.is_tracing()
+                if started_tracemalloc:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+
+                start = time.perf_counter()
+                profiler.enable()
+                try:
+                    response = view(*args, **kwargs)
+                finally:
+                    profiler.disable()
+                    elapsed = time.perf_counter() - start
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+                    if started_tracemalloc:
+                        tracemalloc.stop()
+                        started_tracemalloc = False
+                    try:
+                        self._save(profile_id, reason, profiler, snapshot, elapsed, current, peak)
+                    except Exception as e:
+                        logger.error(f"Failed to save profile {profile_id}: {e}", exc_info=True)
+                        profile_id = None
+            finally:
+                # Never leave tracemalloc running if profiling failed to start
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                self._lock.release()
+
+            if profile_id and reason == 'requested':
+                # Flask views in this app may return (response, status) tuples
+                resp = response[0] if isinstance(response, tuple) else response
+                if hasattr(resp, 'headers'):
+                    resp.headers['X-Profile-Id'] = profile_id
+            return response
+
+        return wrapper
+
+    def _save(self, profile_id, reason, profiler, snapshot, elapsed, current, peak):
+        """Write the pstats dump and JSON summary for a profiled request"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        profiler.dump_stats(self._path(profile_id, '.prof'))
+
+        stats_stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stats_stream)
+        stats.sort_stats('cumulative').print_stats(self.top_n)
+
+        # Ignore allocations made by the profiling machinery itself
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        allocations = []
+        for stat in snapshot.statistics('lineno')[:self.top_n]:
+            frame = stat.traceback[0]
+            allocations.append({
+                'location': f"{frame.filename}:{frame.lineno}",
+                'size_bytes': stat.size,
+                'count': stat.count
+            })
+
+        summary = {
+            'profile_id': profile_id,
+            'reason': reason,
+            'path': request.path,
+            'method': request.method,
+            'created_at': time.time(),
+            'duration_seconds': round(elapsed, 6),
+            'total_calls': stats.total_calls,
+            # tracemalloc traces the whole process, so these include other requests running at the same time
+            'memory': {
+                'scope': 'process',
+                'note': 'Includes allocations from other requests handled concurrently',
+                'current_bytes': current,
+                'peak_bytes': peak
+            },
+            'top_allocations': allocations,
+            'cpu_stats': stats_stream.getvalue()
+        }
+        with open(self._path(profile_id, '.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        logger.info(f"Saved {reason} profile {profile_id} for {request.path} ({elapsed:.3f}s)")
+        self._prune()
+
+    def _prune(self):
+        """Keep only the newest max_profiles profiles on disk"""
+        summaries = [name for name in os.listdir(self.output_dir) if name.endswith('.json')]
+        if len(summaries) <= self.max_profiles:
+            return
+        summaries.sort(key=lambda name: os.path.getmtime(os.path.join(self.output_dir, name)))
+        for name in summaries[:len(summaries) - self.max_profiles]:
+            profile_id = name[:-len('.json')]
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(self._path(profile_id, suffix))
+                except OSError:
+                    pass
+
+    def _path(self, profile_id, suffix):
+        return os.path.join(self.output_dir, f"{profile_id}{suffix}")
+
+    def list_profiles(self):
+        """Return the summaries of stored profiles, newest first"""
+        if not os.path.isdir(self.output_dir):
+            return []
+        profiles = []
+        for name in os.listdir(self.output_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.output_dir, name)) as f:
+                    summary = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read profile summary {name}: {e}")
+                continue
+            profiles.append({
+                key: summary.get(key)
+                for key in ('profile_id', 'reason', 'path', 'method', 'created_at', 'duration_seconds')
+            })
+        profiles.sort(key=lambda p: p.get('created_at') or 0, reverse=True)
+        return profiles
+
+    def get_summary(self, profile_id):
+        """Load the JSON summary for a profile, or None if it does not exist"""
+        path = self.get_stats_path(profile_id, '.json')
+        if not path:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def get_stats_path(self, profile_id, suffix='.prof'):
+        """Return the on-disk path for a profile file, or None if it does not exist"""
+        if not PROFILE_ID_PATTERN.match(profile_id or ''):
+            return None
+        path = self._path(profile_id, suffix)
+        return path if os.path.isfile(path) else None